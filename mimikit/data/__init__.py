@@ -1,5 +1,5 @@
 from .api import Database, FeatureProxy
-from .data_object import DataObject
+from .data_object import DataObject, Batch, zip_stack, as_tensor
 from .factory import make_root_db, AudioFileWalker
 from .regions import Regions
 from .transforms import file_to_fft, default_extract_func, N_FFT, HOP_LENGTH, SR
@@ -2,6 +2,7 @@ import h5py
 import numpy as np
 import pandas as pd
 import os
+from contextlib import contextmanager
 from datetime import datetime
 
 from torch.utils.data.dataset import Subset
@@ -30,6 +31,8 @@ class FeatureProxy(object):
         the length of the first dimension of the underlying array
     shape : tuple of int
         the shape of the underlying array
+    dtype : np.dtype
+        the dtype of the underlying array
     attrs : dict
         dictionary of additional information about the data as returned
         by the ``extract_func`` passed to ``make_root_db``.
@@ -41,20 +44,117 @@ class FeatureProxy(object):
 
         self.h5_file = h5_file
         self.name = ds_name
+        self._file, self._pid = None, None
         with h5py.File(h5_file, "r") as f:
             ds = f[self.name]
             self.N = ds.shape[0]
             self.shape = ds.shape
+            self.dtype = ds.dtype
             self.attrs = {k: v for k, v in ds.attrs.items()}
 
+    def open(self, **kwargs):
+        """
+        keep the file open for the subsequent reads instead of opening it at each call of ``__getitem__``.
+
+        Handles can't be shared between processes, so this should be called in each process - e.g. in the
+        ``worker_init_fn`` of a ``DataLoader`` - that reads from the feature.
+
+        Parameters
+        ----------
+        kwargs
+            passed to ``h5py.File``, e.g. ``rdcc_nbytes`` and ``rdcc_nslots`` to grow the chunk cache.
+
+        Returns
+        -------
+        self : FeatureProxy
+        """
+        self.close()
+        self._file, self._pid = h5py.File(self.h5_file, "r", **kwargs), os.getpid()
+        return self
+
+    def close(self):
+        """close the handle opened by ``open()``, if any"""
+        if self._file is not None and self._pid == os.getpid():
+            self._file.close()
+        self._file, self._pid = None, None
+
+    def __getstate__(self):
+        # h5py handles can't be pickled
+        state = self.__dict__.copy()
+        state["_file"], state["_pid"] = None, None
+        return state
+
     def __len__(self):
         return self.N
 
+    @contextmanager
+    def _dataset(self):
+        """the ``h5py.Dataset`` of the feature, read from the handle opened by ``open()`` if any"""
+        # a handle inherited from a parent process (fork) is not safe to use
+        if self._file is not None and self._pid == os.getpid():
+            yield self._file[self.name]
+        else:
+            with h5py.File(self.h5_file, "r") as f:
+                yield f[self.name]
+
     def __getitem__(self, item):
-        with h5py.File(self.h5_file, "r") as f:
-            rv = f[self.name][item]
+        with self._dataset() as ds:
+            rv = ds[item]
         return rv
 
+    def __getitems__(self, indices):
+        """
+        get the elements at ``indices`` with a single read.
+
+        h5py requires increasing indices for fancy indexing, so the unique indices are read in order and
+        the result is reordered afterwards.
+
+        Parameters
+        ----------
+        indices : Sequence of ints
+
+        Returns
+        -------
+        items : np.ndarray
+            the elements stacked in the order of ``indices``
+        """
+        unique, inverse = np.unique(np.asarray(indices), return_inverse=True)
+        if unique.size == 0:
+            return np.empty((0, *self.shape[1:]), dtype=self.dtype)
+        start, stop = int(unique[0]), int(unique[-1]) + 1
+        if stop - start <= 2 * unique.size:
+            # dense enough : reading the whole span is cheaper than a point-wise selection
+            block = self[start:stop][unique - start]
+        else:
+            block = self[unique]
+        return block[inverse]
+
+    def windows(self, starts, length):
+        """
+        get the windows ``self[start:start + length]`` for each ``start`` in ``starts``.
+
+        Each window is read as one contiguous slice directly into the output, which is much faster than
+        selecting the same rows point-wise.
+
+        Parameters
+        ----------
+        starts : Sequence of ints
+            the first index of each window
+        length : int
+            the length of the windows
+
+        Returns
+        -------
+        windows : np.ndarray
+            array of shape ``(len(starts), length, *self.shape[1:])``
+        """
+        starts = np.asarray(starts, dtype=np.int64).tolist()
+        with self._dataset() as ds:
+            out = np.empty((len(starts), length, *self.shape[1:]), dtype=self.dtype)
+            for b, start in enumerate(starts):
+                ds.read_direct(out, np.s_[start:start + length], np.s_[b])
+        return out
+
     def get(self, regions):
         """
         get the data (numpy array) corresponding to the rows of `regions`
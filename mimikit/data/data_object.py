@@ -1,8 +1,158 @@
 import torch
 import numpy as np
-from torch.utils.data import Dataset as TorchDataset, Subset, random_split, DataLoader
-from torch.utils.data._utils.collate import default_convert
+from torch.utils.data import Dataset as TorchDataset, Subset, random_split, DataLoader, get_worker_info
+from torch.utils.data.dataloader import default_collate
+from collections.abc import Sequence
 from functools import update_wrapper
+from queue import Queue, Full
+from threading import Thread, Event
+
+
+class Batch(list):
+    """
+    list of batched tensors as returned by ``zip_stack``.
+
+    ``Batch`` implements ``pin_memory()`` so that page-locking the batch doesn't depend on the loader
+    knowing how to traverse it.
+    """
+
+    def pin_memory(self):
+        return Batch(t.pin_memory() for t in self)
+
+
+def zip_stack(batch_lists):
+    """
+    collate a list of samples - each sample being a tuple of arrays or tensors - into a list of batched tensors.
+
+    Since all the samples of a batch have the same shapes and dtypes, the output of each feature is allocated once
+    and filled in place instead of being built by ``torch.stack``.
+    Samples that aren't tuples (or lists) are collated by ``default_collate``.
+
+    Parameters
+    ----------
+    batch_lists : list of tuples
+        the samples of the batch
+
+    Returns
+    -------
+    batch : Batch
+        one tensor of shape ``(len(batch_lists), *sample_shape)`` per feature
+    """
+    if not isinstance(batch_lists[0], (tuple, list)):
+        return default_collate(batch_lists)
+    n = len(batch_lists)
+    # like `default_collate`, we write directly in shared memory when we are in a worker process
+    in_worker = get_worker_info() is not None
+    batch = Batch()
+    for i, elem in enumerate(batch_lists[0]):
+        elem = torch.as_tensor(elem)
+        out = torch.empty((n, *elem.shape), dtype=elem.dtype, device=elem.device)
+        if in_worker and out.device.type == "cpu":
+            out.share_memory_()
+        if out.device.type == "cpu" and out.dtype != torch.bfloat16:
+            # on cpu, np.stack is much faster than copying (or torch.stack-ing) the items one by one
+            np.stack([np.asarray(sample[i]) for sample in batch_lists], out=out.numpy())
+        else:
+            for b, sample in enumerate(batch_lists):
+                out[b].copy_(torch.as_tensor(sample[i]))
+        batch.append(out)
+    return batch
+
+
+def as_tensor(x):
+    """
+    convert ``x`` to a ``torch.Tensor``, without copying when ``x`` already is a tensor or a numpy array.
+
+    Parameters
+    ----------
+    x : torch.Tensor, np.ndarray or Sequence
+        a tensor, an array, a sequence of numbers or a sequence of arrays/tensors
+
+    Returns
+    -------
+    tensor : torch.Tensor
+
+    Raises
+    ------
+    TypeError
+        if ``x`` is of none of the above types
+    """
+    if isinstance(x, torch.Tensor):
+        return x
+    if isinstance(x, np.ndarray):
+        return torch.from_numpy(x)
+    if isinstance(x, Sequence) and not isinstance(x, (str, bytes)):
+        if len(x) > 0 and isinstance(x[0], torch.Tensor):
+            return torch.stack(tuple(x))
+        if len(x) > 0 and isinstance(x[0], np.ndarray):
+            return torch.from_numpy(np.stack(x))
+        # numpy parses nested sequences of numbers much faster than torch.tensor,
+        # but we cast to torch's default dtypes (float32, int64) as torch.tensor would.
+        x = np.asarray(x)
+        if np.issubdtype(x.dtype, np.floating):
+            return torch.from_numpy(x).to(torch.get_default_dtype())
+        if np.issubdtype(x.dtype, np.integer):
+            return torch.from_numpy(x.astype(np.int64, copy=False))
+        return torch.from_numpy(x)
+    raise TypeError("Cannot convert object of type %s to tensor." % str(type(x)))
+
+
+def _put(queue, stop, msg):
+    """put ``msg`` in ``queue`` unless ``stop`` gets set while waiting for a free slot"""
+    while not stop.is_set():
+        try:
+            queue.put(msg, timeout=.1)
+            return True
+        except Full:
+            pass
+    return False
+
+
+def prefetch(iterable, maxsize=2):
+    """
+    iterate over ``iterable`` in a background thread that runs at most ``maxsize`` items ahead of the consumer.
+
+    Exceptions raised by ``iterable`` are re-raised in the consuming thread.
+
+    Parameters
+    ----------
+    iterable : Iterable
+        the object to iterate over
+    maxsize : int, optional
+        the maximum number of items fetched in advance
+
+    Returns
+    -------
+    generator : Generator
+        yields the items of ``iterable``
+    """
+    queue, stop = Queue(maxsize=maxsize), Event()
+
+    def produce():
+        try:
+            for item in iterable:
+                if not _put(queue, stop, (False, item)):
+                    return
+        except BaseException as e:
+            _put(queue, stop, (True, e))
+            return
+        _put(queue, stop, (True, None))
+
+    def consume():
+        Thread(target=produce, daemon=True).start()
+        try:
+            while True:
+                done, item = queue.get()
+                if done:
+                    if item is not None:
+                        raise item
+                    return
+                yield item
+        finally:
+            # release the producer if the consumer stopped early
+            stop.set()
+
+    return consume()
 
 
 def map_if_multi(attr):
@@ -127,10 +277,12 @@ class DataObject(TorchDataset):
         if self._is_multi:
             if not all(self._style[0] == style for style in self._style[1:]):
                 raise TypeError("Expected all data_objects to be of the same style. Got %s" % str(self._style))
-            lengths = tuple(len(obj) for obj in self._object)
-            if self._style[0] is "map" and not all(lengths[0] == n for n in lengths[1:]):
-                raise ValueError("Expected all 'map-style' data_objects to be of same lengths. Got %s" % \
-                                 str(lengths))
+            if self._style[0] == "map":
+                # 'iter-style' objects don't necessarily have a length
+                lengths = tuple(len(obj) for obj in self._object)
+                if not all(lengths[0] == n for n in lengths[1:]):
+                    raise ValueError("Expected all 'map-style' data_objects to be of same lengths. Got %s" % \
+                                     str(lengths))
         self._dtype = self.get_dtype()
         if any(dtype is None for dtype in self._dtype):
             raise TypeError("Expected elements of `data_object` to be of torch, numpy or built-in numerical dtype."
@@ -155,7 +307,8 @@ class DataObject(TorchDataset):
 
     def __iter__(self):
         if isinstance(self._object, tuple):
-            return zip(*[iter(obj) for obj in self._object])
+            # each feature is fetched in its own thread so that their I/O overlaps
+            return zip(*[prefetch(obj) for obj in self._object])
         return iter(self._object)
 
     @staticmethod
@@ -249,15 +402,7 @@ class DataObject(TorchDataset):
             return
         elif "iter" in self.style:
             raise TypeError("Cannot convert 'iter' style objects to tensor.")
-        maybe_tensor = default_convert(self._object[:])
-        if issubclass(type(maybe_tensor), torch.Tensor):
-            self._object = maybe_tensor
-            return
-        try:
-            self._object = torch.tensor(self._object)
-        except Exception as e:
-            raise e
-        return
+        self._object = as_tensor(self._object[:])
 
     @map_if_multi("_object")
     def select(self, indices, inplace=False):
@@ -305,6 +450,7 @@ class DataObject(TorchDataset):
 
     def load(self, **kwargs):
         """pack self into a batch producer (Dataloader)"""
+        kwargs.setdefault("collate_fn", zip_stack)
         return DataLoader(self, **kwargs)
 
     def __repr__(self):
@@ -1,8 +1,9 @@
 import h5py
 import numpy as np
 import pandas as pd
-from multiprocessing import cpu_count, Pool
-from typing import Iterable
+from multiprocessing import cpu_count, get_context, get_all_start_methods
+from itertools import chain, islice
+from threading import Semaphore, Event
 import os
 import warnings
 
@@ -16,6 +17,8 @@ warnings.filterwarnings("ignore", message="PySoundFile failed.")
 class AudioFileWalker:
 
     AUDIO_EXTENSIONS = ("wav", "aif", "aiff", "mp3", "m4a", "mp4")
+    # `str.endswith` takes a tuple and checks all the suffixes in C
+    _AUDIO_SUFFIXES = tuple("." + ext.lower() for ext in AUDIO_EXTENSIONS)
 
     def __init__(self, roots=None, files=None):
         """
@@ -37,49 +40,52 @@ class AudioFileWalker:
         any file whose extension isn't in AudioFileWalker.AUDIO_EXTENSIONS will be ignored,
         regardless whether it was found recursively or passed through the `files` argument.
         """
-        generators = []
-
-        if roots is not None and isinstance(roots, Iterable):
-            if isinstance(roots, str):
-                if not os.path.exists(roots):
-                    raise FileNotFoundError("%s does not exist." % roots)
-                generators += [AudioFileWalker.walk_root(roots)]
-            else:
-                for r in roots:
-                    if not os.path.exists(r):
-                        raise FileNotFoundError("%s does not exist." % r)
-                generators += [AudioFileWalker.walk_root(root) for root in roots]
-
-        if files is not None and isinstance(files, Iterable):
-            if isinstance(files, str):
-                if not os.path.exists(files):
-                    raise FileNotFoundError("%s does not exist." % files)
-                generators += [(f for f in [files] if AudioFileWalker.is_audio_file(files))]
-            else:
-                for f in files:
-                    if not os.path.exists(f):
-                        raise FileNotFoundError("%s does not exist." % f)
-                generators += [(f for f in files if AudioFileWalker.is_audio_file(f))]
-
-        self.generators = generators
+        self.roots = AudioFileWalker._as_paths(roots)
+        self.files = AudioFileWalker._as_paths(files)
+        checked = set()
+        for path in chain(self.roots, self.files):
+            if path not in checked:
+                if not os.path.exists(path):
+                    raise FileNotFoundError("%s does not exist." % path)
+                checked.add(path)
 
     def __iter__(self):
-        for generator in self.generators:
-            for file in generator:
-                yield file
+        # nothing is walked before we iterate
+        for root in self.roots:
+            yield from AudioFileWalker.walk_root(root)
+        yield from filter(AudioFileWalker.is_audio_file, self.files)
+
+    @staticmethod
+    def _as_paths(paths):
+        """normalize a single path, an iterable of paths or None to a tuple of str"""
+        if paths is None:
+            return ()
+        if isinstance(paths, (str, os.PathLike)):
+            paths = (paths, )
+        return tuple(os.fspath(p) for p in paths)
 
     @staticmethod
     def walk_root(root):
-        for directory, _, files in os.walk(root):
-            for audio_file in filter(AudioFileWalker.is_audio_file, files):
-                yield os.path.join(directory, audio_file)
+        # DirEntries know whether they are directories without an extra stat (which os.walk does)
+        stack = [root]
+        while stack:
+            try:
+                entries = os.scandir(stack.pop())
+            except OSError:
+                # like os.walk, skip what can't be listed (unreadable directories, roots that are files...)
+                continue
+            with entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif AudioFileWalker.is_audio_file(entry.name):
+                        yield entry.path
 
     @staticmethod
     def is_audio_file(filename):
+        name = os.path.basename(filename.rstrip("/"))
         # filter out hidden files
-        if os.path.split(filename.strip("/"))[-1].startswith("."):
-            return False
-        return os.path.splitext(filename)[-1].strip(".") in AudioFileWalker.AUDIO_EXTENSIONS
+        return name[:1] != "." and name.lower().endswith(AudioFileWalker._AUDIO_SUFFIXES)
 
 
 def _sizeof_fmt(num, suffix='b'):
@@ -90,6 +96,36 @@ def _sizeof_fmt(num, suffix='b'):
     return "%.1f%s%s" % (num, 'Yi', suffix)
 
 
+# chunk cache for the files we write into during aggregation
+_H5_CACHE = dict(rdcc_nbytes=64 * 2 ** 20, rdcc_nslots=12421, rdcc_w0=.75)
+
+
+def _chunks(shape, dtype, nbytes=2 ** 20):
+    """
+    chunk shape of about ``nbytes`` (the size of h5py's default chunk cache) for a dataset of shape ``shape``.
+    Chunks span whole rows since we always read and write along the first axis.
+    """
+    if len(shape) == 0:
+        return None
+    if shape[0] == 0:
+        return True
+    row_nbytes = np.dtype(dtype).itemsize * int(np.prod(shape[1:], dtype=np.int64))
+    rows = max(1, nbytes // max(1, row_nbytes))
+    return (min(rows, shape[0]), *shape[1:])
+
+
+def _filters(compression):
+    """
+    keyword arguments of ``create_dataset`` for ``compression`` which can be ``None``, the name of a filter
+    (e.g. "lzf" or "gzip") that is then combined with the shuffle filter, or a dict of such keyword arguments.
+    """
+    if compression is None:
+        return {}
+    if isinstance(compression, dict):
+        return dict(compression)
+    return dict(compression=compression, shuffle=True)
+
+
 # Core function
 
 def file_to_db(abs_path, extract_func=default_extract_func, output_path=None, mode="w"):
@@ -116,37 +152,80 @@ def file_to_db(abs_path, extract_func=default_extract_func, output_path=None, mo
     print("making .h5 for %s" % abs_path)
     if output_path is None:
         output_path = os.path.splitext(abs_path)[0] + ".h5"
-    else:
-        if output_path[-3:] != ".h5":
-            output_path += ".h5"
+    elif not output_path.endswith(".h5"):
+        output_path += ".h5"
     rv = extract_func(abs_path)
     if "regions" not in rv:
         raise ValueError("Expected `extract_func` to return a ('regions', Regions) item. Found none")
-    info = {}
-    f = h5py.File(output_path, mode)
-    for name, (attrs, data) in rv.items():
-        if issubclass(type(data), np.ndarray):
-            ds = f.create_dataset(name=name, shape=data.shape, data=data)
-            ds.attrs.update(attrs)
-            info[name] = {"dtype": ds.dtype, "shape": ds.shape}
-        elif issubclass(type(data), pd.DataFrame):
-            f.close()
-            pd.DataFrame(data).to_hdf(output_path, name, "r+")
-            f = h5py.File(output_path, "r+")
-    f.flush()
-    f.close()
+    info, frames = {}, {}
+    with h5py.File(output_path, mode) as f:
+        for name, (attrs, data) in rv.items():
+            if issubclass(type(data), np.ndarray):
+                ds = f.create_dataset(name=name, shape=data.shape, data=data,
+                                      chunks=_chunks(data.shape, data.dtype))
+                ds.attrs.update(attrs)
+                info[name] = {"dtype": ds.dtype, "shape": ds.shape}
+            elif issubclass(type(data), pd.DataFrame):
+                frames[name] = pd.DataFrame(data)
+    # write all the DataFrames in a single PyTables session once h5py released the file
+    with pd.HDFStore(output_path, mode="r+") as store:
+        for name, df in frames.items():
+            store.put(name, df)
     return output_path, info
 
 
 # Multiprocessing routine
 
+# the extracting function of the workers of the Pool, set once per worker by `_init_worker`
+_EXTRACT_FUNC = None
+
+
+def _init_worker(extract_func):
+    global _EXTRACT_FUNC
+    _EXTRACT_FUNC = extract_func
+
+
+_TMP_PREFIX = ".tmp_"
+
+
+def _tmp_db(path):
+    """add the ".tmp_" prefix to the name of ``path``"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, _TMP_PREFIX + name)
+
+
+def _untmp(path):
+    """remove the ".tmp_" prefix from the name of ``path``"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, name[len(_TMP_PREFIX):] if name.startswith(_TMP_PREFIX) else name)
+
+
+def _tmp_file_to_db(file, extract_func):
+    return file_to_db(file, extract_func, _tmp_db(file))
+
+
+def _worker_file_to_db(file):
+    return _tmp_file_to_db(file, _EXTRACT_FUNC)
+
+
+def _throttled(iterable, semaphore, done):
+    """yield the items of ``iterable`` as long as ``semaphore`` can be acquired and ``done`` isn't set"""
+    for item in iterable:
+        while not semaphore.acquire(timeout=.1):
+            if done.is_set():
+                return
+        yield item
+
+
 def _make_db_for_each_file(file_walker,
                            extract_func=default_extract_func,
                            n_cores=cpu_count()):
     """
     apply ``extract_func`` to the files found by ``file_walker``
 
-    If file_walker found more than ``n_cores`` files, a multiprocessing ``Pool`` is used to speed up the process.
+    If file_walker finds more than ``n_cores`` files, a multiprocessing ``Pool`` is used to speed up the process.
+    The files are consumed lazily, at most ``2 * n_cores`` of them are being processed or waiting to be yielded
+    at any time, and the results are yielded, in the order of the files, as soon as they are ready.
 
     Parameters
     ----------
@@ -159,18 +238,30 @@ def _make_db_for_each_file(file_walker,
 
     Returns
     -------
-    temp_dbs : list of tuples
-        each tuple in the list is of the form ``("<created_file>.h5", dict(feature_name=dict(dtype=..., shape=...), ...))``
+    temp_dbs : generator of tuples
+        each tuple is of the form ``("<created_file>.h5", dict(feature_name=dict(dtype=..., shape=...), ...))``
     """
-    # add ".tmp_" prefix to the output_paths
-    args = [(file, extract_func, os.path.join(os.path.split(file)[0], ".tmp_" + os.path.split(file)[1]))
-            for file in file_walker]
-    if len(args) > n_cores:
-        with Pool(n_cores) as p:
-            tmp_dbs_infos = p.starmap(file_to_db, args)
-    else:
-        tmp_dbs_infos = [file_to_db(*arg) for arg in args]
-    return tmp_dbs_infos
+    files = iter(file_walker)
+    # only peek at as many files as needed to decide whether a Pool is worth it
+    head = list(islice(files, n_cores + 1))
+    if len(head) <= n_cores:
+        for file in head:
+            yield _tmp_file_to_db(file, extract_func)
+        return
+    # fork doesn't re-import mimikit in every worker but isn't available everywhere
+    ctx = get_context("fork" if "fork" in get_all_start_methods() else "spawn")
+    # the Pool consumes its inputs as fast as it can : we only let it be 2 * n_cores files ahead of the results
+    # so that the extracted files don't pile up in memory
+    in_flight, done = Semaphore(2 * n_cores), Event()
+    with ctx.Pool(n_cores, initializer=_init_worker, initargs=(extract_func,), maxtasksperchild=32) as p:
+        try:
+            for tmp_db_infos in p.imap(_worker_file_to_db, _throttled(chain(head, files), in_flight, done),
+                                       chunksize=1):
+                in_flight.release()
+                yield tmp_db_infos
+        finally:
+            # unblock the Pool's feeder if we stopped early
+            done.set()
 
 
 def _aggregate_db_infos(infos):
@@ -186,30 +277,73 @@ def _aggregate_db_infos(infos):
     -------
     ds_definitions : dict
         the keys are the name of the H5Datasets (features)
-        the values are dictionaries with keys ("shape", "dtype", "regions") and corresponding values
+        the values are dictionaries with keys ("shape", "dtype", "meta_regions", "chunks") and corresponding values
     """
-    paths = [x[0] for x in infos]
-    features = set([feature for db in infos for feature in db[1].keys()])
+    paths = [path for path, _ in infos]
+    # a single pass over the infos. Features are kept in order of appearance for the db to be deterministic
+    dtypes, shapes = {}, {}
+    for _, db in infos:
+        for f, info in db.items():
+            dtypes.setdefault(f, set()).add(info["dtype"])
+            shapes.setdefault(f, []).append(info["shape"])
     ds_definitions = {}
-    for f in features:
-        dtype = set([db[1][f]["dtype"] for db in infos])
-        assert len(dtype) == 1, "aggregated features must be of a unique dtype"
-        dtype = dtype.pop()
-        shapes = [db[1][f]["shape"] for db in infos]
-        dims = shapes[0][1:]
-        assert all(shp[1:] == dims for shp in
-                   shapes[1:]), "all features should have the same dimensions but for the first axis"
+    for f in dtypes:
+        assert len(shapes[f]) == len(paths), "all files must have the same features"
+        assert len(dtypes[f]) == 1, "aggregated features must be of a unique dtype"
+        dtype = dtypes[f].pop()
+        dims = shapes[f][0][1:]
+        assert len(set(len(shp) for shp in shapes[f])) == 1 and \
+            np.all(np.asarray(shapes[f])[:, 1:] == dims), \
+            "all features should have the same dimensions but for the first axis"
         # collect the regions for the files
-        regions = Regions.from_duration([s[0] for s in shapes])
+        regions = Regions.from_duration([shp[0] for shp in shapes[f]])
         ds_shape = (regions.last_stop, *dims)
         regions.index = paths
-        ds_definitions[f] = {"shape": ds_shape, "dtype": dtype, "meta_regions": regions}
+        ds_definitions[f] = {"shape": ds_shape, "dtype": dtype, "meta_regions": regions,
+                             "chunks": _chunks(ds_shape, dtype)}
     return ds_definitions
 
 
 # Aggregating function
 
-def _aggregate_dbs(target, tmp_dbs_infos, mode="w"):
+def _integrate(trgt, source, key, indices, buffer=None):
+    """
+    copy the feature ``key`` of the file ``source`` into ``trgt[key][indices]``
+
+    Parameters
+    ----------
+    trgt : h5py.File
+        the (opened) target file
+    source : str
+        name of the file to copy from
+    key : str
+        name of the feature
+    indices : tuple of slices
+        where to write the data in the target's feature
+    buffer : np.ndarray, optional
+        array in which the data is read if it is big enough and of the right dtype
+
+    Returns
+    -------
+    buffer : np.ndarray
+        the array that has been used as buffer, to be passed to the next call
+    """
+    with h5py.File(source, "r") as src:
+        ds = src[key]
+        trgt[key].attrs.update({k: v for k, v in ds.attrs.items()})
+        if ds.shape[0] == 0:
+            return buffer
+        if buffer is None or buffer.dtype != ds.dtype or buffer.shape[1:] != ds.shape[1:] \
+                or buffer.shape[0] < ds.shape[0]:
+            buffer = np.empty(ds.shape, dtype=ds.dtype)
+        data = buffer[:ds.shape[0]]
+        # read and write straight from/to the buffer instead of allocating a new array for each file
+        ds.read_direct(data)
+        trgt[key].write_direct(data, dest_sel=indices)
+    return buffer
+
+
+def _aggregate_dbs(target, tmp_dbs_infos, mode="w", compression="lzf"):
     """
     copy a list of .h5 files as defined in ``tmp_dbs_infos`` into ``target``
 
@@ -217,21 +351,19 @@ def _aggregate_dbs(target, tmp_dbs_infos, mode="w"):
     ----------
     target : str
         name for the target file
-    tmp_dbs_infos : list
+    tmp_dbs_infos : iterable
         see the returned value of ``_make_db_for_each_file`` for the expected type
     mode : str
-        the mode with which ``target`` is opened the first time. Must be 'w' if ``target`` doesn't exist.
+        the mode with which ``target`` is opened. Must be 'w' if ``target`` doesn't exist.
+    compression : str, dict or None, optional
+        the filter applied to the features of ``target``. Either the name of a filter (default is "lzf") that is
+        combined with the shuffle filter, a dict of filter keyword arguments for ``h5py.Group.create_dataset``
+        or ``None`` for no compression at all.
     """
+    # the shapes of all the files are needed before we can create the master datasets
+    tmp_dbs_infos = list(tmp_dbs_infos)
     features_infos = _aggregate_db_infos(tmp_dbs_infos)
 
-    # open the file & create the master datasets to host the features
-    with h5py.File(target, mode) as f:
-        # add the list of features
-        f.attrs["features"] = list(features_infos.keys())
-        for name, params in features_infos.items():
-            f.create_dataset(name, shape=params["shape"], dtype=params["dtype"],
-                             chunks=True, maxshape=(None, *params["shape"][1:]))
-
     # prepare args for copying the tmp_files into the appropriate regions
     args = []
     for feature, info in features_infos.items():
@@ -239,22 +371,29 @@ def _aggregate_dbs(target, tmp_dbs_infos, mode="w"):
         args += [(source, feature, indices) for source, indices in
                  zip(info["meta_regions"].index, info["meta_regions"].slices(time_axis=0))]
 
-    # copy the data
-    intra_regions = None
-    for source, key, indices in args:
-        with h5py.File(source, "r") as src:
-            data = src[key][()]
-            attrs = {k: v for k, v in src[key].attrs.items()}
-        # concat the regions :
-        regions = pd.read_hdf(source, key="regions", mode="r")
-        regions.loc[:, ("start", "stop")] += indices[0].start
-        # remove ".tmp_" from the source's name
-        regions.loc[:, "name"] = "".join(source.split(".tmp_"))
-        intra_regions = pd.concat(([intra_regions] if intra_regions is not None else []) + [regions])
-        with h5py.File(target, "r+") as trgt:
-            trgt[key][indices] = data
-            trgt[key].attrs.update(attrs)
-    pd.DataFrame(intra_regions).to_hdf(target, "regions", mode="r+")
+    intra_regions = []
+    # a single session for creating the master datasets and copying the data
+    with h5py.File(target, mode, **_H5_CACHE) as trgt:
+        # add the list of features
+        trgt.attrs["features"] = list(features_infos.keys())
+        for name, params in features_infos.items():
+            trgt.create_dataset(name, shape=params["shape"], dtype=params["dtype"],
+                                chunks=params["chunks"] or True, maxshape=(None, *params["shape"][1:]),
+                                **_filters(compression))
+
+        # copy the data (h5py serializes all its calls, so there's nothing to gain from threads here)
+        buffer = None
+        for source, key, indices in args:
+            buffer = _integrate(trgt, source, key, indices, buffer)
+            # concat the regions :
+            regions = pd.read_hdf(source, key="regions", mode="r")
+            # whole-column operations don't go through the (slow) indexing machinery of `.loc`
+            regions["start"] += indices[0].start
+            regions["stop"] += indices[0].start
+            regions["name"] = _untmp(source)
+            intra_regions.append(regions)
+    # concatenating once is linear in the number of files, concatenating at each file was quadratic
+    pd.concat(intra_regions).to_hdf(target, "regions", mode="r+")
 
     # remove the temp_dbs
     for src, _ in tmp_dbs_infos:
@@ -263,7 +402,7 @@ def _aggregate_dbs(target, tmp_dbs_infos, mode="w"):
 
 
 def make_root_db(db_name, roots='./', files=None, extract_func=default_extract_func,
-                 n_cores=cpu_count()):
+                 n_cores=cpu_count(), compression="lzf"):
     """
     extract and aggregate several files into a single .h5 Database
 
@@ -283,6 +422,10 @@ def make_root_db(db_name, roots='./', files=None, extract_func=default_extract_f
     n_cores : int, optional
         the number of cores to use to parallelize the extraction process.
         default is the number of available cores on the system.
+    compression : str, dict or None, optional
+        the compression of the features in the db. default is "lzf" which is fast and always available.
+        Pass ``None`` for uncompressed features (fastest reads on fast disks).
+        See ``_aggregate_dbs`` for the accepted values.
 
     Returns
     -------
@@ -291,5 +434,5 @@ def make_root_db(db_name, roots='./', files=None, extract_func=default_extract_f
     """
     walker = AudioFileWalker(roots, files)
     tmp_dbs_infos = _make_db_for_each_file(walker, extract_func, n_cores)
-    _aggregate_dbs(db_name, tmp_dbs_infos, "w")
+    _aggregate_dbs(db_name, tmp_dbs_infos, "w", compression)
     return Database(db_name)
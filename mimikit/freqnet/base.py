@@ -1,11 +1,16 @@
 import torch
+import numpy as np
 from pytorch_lightning import LightningModule, LightningDataModule
-from torch.utils.data import DataLoader
+from torch.utils.data import DataLoader, Subset, get_worker_info
 import librosa
 from abc import ABC
+from contextlib import nullcontext, contextmanager
+from inspect import signature
+from multiprocessing import cpu_count
+import warnings
 
-from ..data import DataObject, FeatureProxy, HOP_LENGTH
-from ..kit import ShiftedSeqsPair, MMKHooks, LoggingHooks, tqdm
+from ..data import DataObject, FeatureProxy, Batch, HOP_LENGTH, zip_stack, as_tensor
+from ..kit import ShiftedSeqsPair, FrameSampler, MMKHooks, LoggingHooks, tqdm
 
 
 class ManyOneCycleLR(torch.optim.lr_scheduler.OneCycleLR):
@@ -57,14 +62,79 @@ class FreqOptim:
         return [self.opt], [{"scheduler": self.sched, "interval": "step", "frequency": 1}]
 
 
+class TensorSeqsLoader:
+    """
+    batch producer for a ``Subset`` of a ``ShiftedSeqsPair`` whose data is a single tensor already in memory.
+
+    The sequences of each batch are gathered out of the tensor with a single indexing operation per
+    sequence-type (input and targets) : no worker, no collate and no copy but the one that builds the batch.
+    """
+    def __init__(self, subset, batch_size=64, shuffle=True, drop_last=False, pin_memory=False):
+        wrapped = subset.dataset
+        self.data = wrapped.data
+        self.sampler = FrameSampler(np.asarray(subset.indices) * wrapped.stride, batch_size, shuffle, drop_last)
+        self.windows = tuple(torch.arange(shift, shift + length, device=self.data.device)
+                             for shift, length in zip(wrapped.shifts, wrapped.lengths))
+        self.pin_memory = pin_memory
+
+    def __len__(self):
+        return len(self.sampler)
+
+    def __iter__(self):
+        for starts in self.sampler:
+            starts = torch.from_numpy(starts).to(self.data.device).unsqueeze(1)
+            batch = Batch(self.data[starts + window] for window in self.windows)
+            yield batch.pin_memory() if self.pin_memory else batch
+
+
+# `persistent_workers` and `prefetch_factor` only exist for torch >= 1.7
+_LOADER_PARAMS = signature(DataLoader).parameters
+
+
+def _as_batch(batch):
+    """collate_fn for datasets that already return batches : only converts them to tensors"""
+    return Batch(as_tensor(x) for x in batch)
+
+
+def _find_feature_proxies(obj):
+    """collect the ``FeatureProxies`` nested in ``Subsets``, ``DataObjects`` and tuples"""
+    if isinstance(obj, FeatureProxy):
+        return [obj]
+    if isinstance(obj, Subset):
+        return _find_feature_proxies(obj.dataset)
+    if isinstance(obj, DataObject):
+        return _find_feature_proxies(obj.data)
+    if isinstance(obj, tuple):
+        return [proxy for x in obj for proxy in _find_feature_proxies(x)]
+    return []
+
+
+def _as_slice(index):
+    """``None`` selects all the time-steps and an int selects one time-step without dropping the time axis"""
+    if index is None:
+        return slice(None)
+    if isinstance(index, int):
+        return slice(index, index + 1 or None)
+    return index
+
+
 class FreqData(LightningDataModule):
     """
     boilerplate subclass of ``pytorch_lightning.LightningDataModule`` to handle the data of a ``FreqNetModel``.
 
     the data is passed through ``data_object``, wrapped in a ``ShiftedSeqsPair`` in ``prepare_data()`` and
     in ``setup("fit")`` it is moved to the gpu if ``in_mem_data`` is ``True`` and split into train, val and test sets
-    according to ``splits``
+    according to ``splits``.
+
+    When the data is a single tensor, the loaders are ``TensorSeqsLoader`` which slice the batches directly
+    out of the tensor. Otherwise, they are ``DataLoader`` configured with ``loader_kwargs``. For arrays and
+    ``FeatureProxies``, those fetch each batch with a single call to the dataset and skip collation.
     """
+    # chunk cache of the h5 files opened in each worker
+    H5_CACHE_BYTES = 64 * 2 ** 20
+    # number of hash-table slots of the chunk cache (should be a prime)
+    H5_CACHE_SLOTS = 12421
+
     def __init__(self,
                  model,
                  data_object=None,
@@ -83,6 +153,7 @@ class FreqData(LightningDataModule):
         self.splits = splits
         loader_kwargs.setdefault("drop_last", False)
         loader_kwargs.setdefault("shuffle", True)
+        loader_kwargs.setdefault("collate_fn", zip_stack)
         self.loader_kwargs = loader_kwargs
         self.train_ds, self.val_ds, self.test_ds = None, None, None
 
@@ -104,13 +175,73 @@ class FreqData(LightningDataModule):
             sets = self.ds.split(self.splits)
             for ds, attr in zip(sets, ["train_ds", "val_ds", "test_ds"]):
                 setattr(self, attr, ds)
+            self._set_defaults_loader_kwargs()
+
+    def _data_is_on_gpu(self):
+        return isinstance(self.ds.data, torch.Tensor) and self.ds.data.is_cuda
+
+    def _data_is_in_mem(self):
+        return isinstance(self.ds.data, (torch.Tensor, np.ndarray))
+
+    def _set_defaults_loader_kwargs(self):
+        """
+        defaults that depend on where the data ended up after ``setup("fit")``
+        """
+        # batches coming from the host are pinned for faster transfers to the gpu
+        self.loader_kwargs.setdefault("pin_memory", torch.cuda.is_available() and not self._data_is_on_gpu())
+        # indexing data that is already in memory is cheaper than any worker process,
+        # and for data on disk, a few workers are enough to keep up with the model.
+        self.loader_kwargs.setdefault("num_workers", 0 if self._data_is_in_mem() else min(8, cpu_count() // 2))
+        if self.loader_kwargs["num_workers"] > 0:
+            if "persistent_workers" in _LOADER_PARAMS:
+                self.loader_kwargs.setdefault("persistent_workers", True)
+            if "prefetch_factor" in _LOADER_PARAMS:
+                self.loader_kwargs.setdefault("prefetch_factor", 2)
+            if _find_feature_proxies(self.ds):
+                self.loader_kwargs.setdefault("worker_init_fn", FreqData.worker_init_fn)
+
+    @staticmethod
+    def worker_init_fn(worker_id):
+        """
+        open the h5 files of the worker's copy of the dataset once and for all, with a chunk cache of its own.
+
+        h5py handles inherited from the parent process are not safe to use after a fork.
+        """
+        info = get_worker_info()
+        for proxy in _find_feature_proxies(info.dataset):
+            proxy.open(rdcc_nbytes=FreqData.H5_CACHE_BYTES, rdcc_nslots=FreqData.H5_CACHE_SLOTS)
+
+    def _fast_tensor_loader(self, ds, shuffle):
+        return TensorSeqsLoader(ds, self.batch_size, shuffle,
+                                drop_last=self.loader_kwargs["drop_last"],
+                                pin_memory=self.loader_kwargs.get("pin_memory", False))
+
+    def _batched_loader(self, ds, **kwargs):
+        # the sampler yields arrays of indices and the dataset returns whole batches for them,
+        # hence there is nothing left to collate.
+        sampler = FrameSampler(ds.indices, self.batch_size, kwargs.pop("shuffle"), kwargs.pop("drop_last"))
+        kwargs.pop("collate_fn")
+        return DataLoader(ds.dataset, batch_size=None, sampler=sampler, collate_fn=_as_batch, **kwargs)
+
+    def _loader(self, ds, **kwargs):
+        # the shortcuts below handle the sampling and the collation themselves,
+        # hence they only apply when the user didn't customize those.
+        default_loading = kwargs["collate_fn"] is zip_stack \
+            and kwargs.get("sampler") is None and kwargs.get("batch_sampler") is None
+        if isinstance(self.ds, ShiftedSeqsPair) and default_loading:
+            # a tensor that is already in memory doesn't need the machinery of a DataLoader
+            if isinstance(self.ds.data, torch.Tensor) and kwargs.get("worker_init_fn") is None:
+                return self._fast_tensor_loader(ds, kwargs["shuffle"])
+            if isinstance(self.ds.data, (np.ndarray, FeatureProxy)):
+                return self._batched_loader(ds, **kwargs)
+        return DataLoader(ds, batch_size=self.batch_size, **kwargs)
 
     def train_dataloader(self):
         if not self.has_prepared_data:
             self.prepare_data()
         if not self.has_setup_fit:
             self.setup("fit")
-        return DataLoader(self.train_ds, batch_size=self.batch_size, **self.loader_kwargs)
+        return self._loader(self.train_ds, **self.loader_kwargs)
 
     def val_dataloader(self, shuffle=False):
         has_val = len(self.splits) >= 2 and self.splits[1] is not None
@@ -122,7 +253,7 @@ class FreqData(LightningDataModule):
             self.setup("fit")
         kwargs = self.loader_kwargs.copy()
         kwargs["shuffle"] = shuffle
-        return DataLoader(self.val_ds, batch_size=self.batch_size, **kwargs)
+        return self._loader(self.val_ds, **kwargs)
 
     def test_dataloader(self, shuffle=False):
         has_test = len(self.splits) >= 3 and self.splits[2] is not None
@@ -134,7 +265,7 @@ class FreqData(LightningDataModule):
             self.setup("test")
         kwargs = self.loader_kwargs.copy()
         kwargs["shuffle"] = shuffle
-        return DataLoader(self.test_ds, batch_size=self.batch_size, **kwargs)
+        return self._loader(self.test_ds, **kwargs)
 
 
 class FreqNetModel(MMKHooks,
@@ -161,6 +292,7 @@ class FreqNetModel(MMKHooks,
                  final_div_factor=1.,
                  pct_start=.25,
                  cycle_momentum=False,
+                 bf16_autocast=True,
                  **loaders_kwargs):
         super(FreqNetModel, self).__init__()
         # dimensionality of inputs is automatically available
@@ -174,18 +306,43 @@ class FreqNetModel(MMKHooks,
                              "FreqNetModel.load_from_checkpoint(path_to_ckpt, data_object=my_data_object)")
         self.optim = FreqOptim(self, max_lr, betas, div_factor, final_div_factor, pct_start,
                                cycle_momentum)
+        self.bf16_autocast = bf16_autocast
         # calling this updates self.hparams from any subclass : call it when subclassing!
         self.save_hyperparameters()
 
+    def _autocast(self):
+        """
+        context in which forward passes run in bfloat16 when ``bf16_autocast`` is ``True`` and the gpu supports it
+        (and the trainer doesn't already handle mixed precision).
+        """
+        enabled = self.bf16_autocast and self.device.type == "cuda" and hasattr(torch, "autocast") \
+            and torch.cuda.is_bf16_supported() and getattr(self.trainer, "precision", 32) == 32
+        return torch.autocast("cuda", dtype=torch.bfloat16) if enabled else nullcontext()
+
+    def transfer_batch_to_device(self, batch, device=None, *args):
+        """
+        copy the tensors of the batch asynchronously when possible.
+
+        Copies from pinned memory with ``non_blocking=True`` overlap with the computations on the previous batch.
+        Since they are enqueued on the current stream, the forward pass still waits for them and no extra
+        synchronization is needed.
+        """
+        device = device or self.device
+        if isinstance(batch, (list, tuple)) and all(isinstance(x, torch.Tensor) for x in batch):
+            return Batch(x.to(device, non_blocking=True) for x in batch)
+        return super(FreqNetModel, self).transfer_batch_to_device(batch, device, *args)
+
     def training_step(self, batch, batch_idx):
         batch, target = batch
-        output = self.forward(batch)
+        with self._autocast():
+            output = self.forward(batch)
         recon = self.loss_fn(output, target)
         return {"loss": recon}
 
     def validation_step(self, batch, batch_idx):
         batch, target = batch
-        output = self.forward(batch)
+        with self._autocast():
+            output = self.forward(batch)
         recon = self.loss_fn(output, target)
         return {"val_loss": recon}
 
@@ -229,27 +386,105 @@ class FreqNetModel(MMKHooks,
     def targets_shifts_and_lengths(self, input_length):
         raise NotImplementedError("subclasses of `FreqNetModel` have to implement `targets_shifts_and_lengths`")
 
-    def generate(self, prompt, n_steps, hop_length=HOP_LENGTH, time_domain=True):
-        was_training = self.training
+    def prepare_prompt(self, prompt, n_steps):
+        """
+        allocate the tensor in which ``n_steps`` time-steps will be generated after ``prompt``
+
+        Parameters
+        ----------
+        prompt : torch.Tensor
+            tensor of shape ``(batch, time, ...)``
+        n_steps : int
+            the number of time-steps to append to ``prompt``
+
+        Returns
+        -------
+        generated : torch.Tensor
+            tensor of shape ``(batch, time + n_steps, ...)`` on ``self.device`` starting with ``prompt``.
+            The appended time-steps are left uninitialized since they are written in place during the generation.
+        """
+        n_prompt = prompt.size(1)
+        generated = torch.empty(prompt.size(0), n_prompt + n_steps, *prompt.shape[2:],
+                                dtype=prompt.dtype, device=self.device)
+        generated[:, :n_prompt].copy_(prompt)
+        return generated
+
+    def _graphed_step(self, example):
+        """
+        capture a forward pass on inputs shaped like ``example`` in a CUDA graph and return a function replaying it.
+        """
+        static_input = example.clone()
+        # warm-up on a side stream is required before capturing
+        stream = torch.cuda.Stream()
+        stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(stream):
+            for _ in range(3):
+                self(static_input)
+        torch.cuda.current_stream().wait_stream(stream)
+        graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(graph):
+            static_output = self(static_input)
+
+        def step(inpt):
+            static_input.copy_(inpt)
+            graph.replay()
+            return static_output
+
+        return step
+
+    @contextmanager
+    def generation_mode(self):
+        """
+        context in which the model is in eval mode, on the gpu if one is available, and doesn't track gradients
+        (``torch.inference_mode`` if available, else ``torch.no_grad``).
+        The training state and the device of the model are restored on exit, even if an exception was raised.
+        """
+        was_training, initial_device = self.training, self.device
         self.eval()
-        initial_device = self.device
         self.to("cuda" if torch.cuda.is_available() else "cpu")
-        if not isinstance(prompt, torch.Tensor):
-            prompt = torch.from_numpy(prompt)
-        if len(prompt.shape) < 3:
-            prompt = prompt.unsqueeze(0)
-        input_slice, output_slice = self.generation_slices()
-        generated = prompt.to(self.device)
-        for _ in tqdm(range(n_steps), desc="Generate", dynamic_ncols=True, leave=False, unit="step"):
-            with torch.no_grad():
-                out = self(generated[:, input_slice])
-                generated = torch.cat((generated, out[:, output_slice]), dim=1)
+        try:
+            with (torch.inference_mode() if hasattr(torch, "inference_mode") else torch.no_grad()):
+                yield self
+        finally:
+            self.to(initial_device)
+            self.train(was_training)
+
+    def generate(self, prompt, n_steps, hop_length=HOP_LENGTH, time_domain=True, cuda_graph=True):
+        with self.generation_mode():
+            if not isinstance(prompt, torch.Tensor):
+                prompt = torch.from_numpy(prompt)
+            if len(prompt.shape) < 3:
+                prompt = prompt.unsqueeze(0)
+            prompt = prompt.to(self.device)
+            input_slice, output_slice = map(_as_slice, self.generation_slices())
+            generated, t = prompt, prompt.size(1)
+            step = self
+            for i in tqdm(range(n_steps), desc="Generate", dynamic_ncols=True, leave=False, unit="step"):
+                inpt = generated[:, slice(*input_slice.indices(t))]
+                out = step(inpt)[:, output_slice]
+                n = out.size(1)
+                if t + n > generated.size(1):
+                    # the number of time-steps per step is only known once we ran one (and can grow with the
+                    # inputs), then we allocate the time-steps of all the remaining steps at once
+                    first_step = generated is prompt
+                    generated = self.prepare_prompt(generated[:, :t], (n_steps - i) * n)
+                    # if the inputs have a fixed shape, the next steps can replay a CUDA graph
+                    fixed_shape = inpt.size(1) == len(range(*input_slice.indices(generated.size(1))))
+                    if first_step and cuda_graph and fixed_shape and self.device.type == "cuda" \
+                            and hasattr(torch.cuda, "graph"):
+                        try:
+                            step = self._graphed_step(inpt)
+                        except RuntimeError as e:
+                            warnings.warn("Could not capture the generation step in a CUDA graph (%s). "
+                                          "Falling back to standard forward passes." % str(e))
+                generated[:, t:t + n] = out
+                t += n
+            generated = generated[:, :t]
         if time_domain:
             generated = generated.transpose(1, 2).squeeze()
             generated = librosa.griffinlim(generated.cpu().numpy(), hop_length=hop_length, n_iter=64)
             generated = torch.from_numpy(generated)
         else:  # for consistency with time_domain :
-            generated = generated.cpu()
-        self.to(initial_device)
-        self.train() if was_training else None
+            # copying outside of inference mode returns a regular tensor
+            generated = generated.to("cpu", copy=True)
         return generated.unsqueeze(0)
@@ -52,6 +52,8 @@ class FreaksNet(FreqNet):
                       **{k: v[j][i] for k, v in layer_kwargs.items()})
             for j, n_layers in enumerate(self.n_layers) for i in range(n_layers)
         ])
+        # forget anything computed for the layers built by FreqNet.__init__
+        self._arch_cache = {}
 
         # Output Decoder
         self.outpt = AbsLinearOutput(self.model_dim, self.input_dim)
@@ -1,7 +1,8 @@
 import torch
 import torch.nn as nn
-import numpy as np
+import torch.nn.functional as F
 import math
+from typing import Optional, Tuple
 
 from .modules import GatedConv, LearnablePad1d
 
@@ -12,14 +13,12 @@ def accum(x, y, shift=1):
             return x + y
         else:
             raise ValueError("zero shift with size: %i and %i" % (x.size(-1), y.size(-1)))
-    side = np.sign(shift)
-    aligned_x = slice(*((shift, None)[::side]))
     n_aligned = x.size(-1) - abs(shift)
-    aligned_y = slice(*((None, n_aligned * side)[::side]))
-    compl_y = slice(*((n_aligned * side, None)[::side]))
-    aligned = x[:, :, aligned_x] + y[:, :, aligned_y]
-    rest = y[:, :, compl_y]
-    return torch.cat((aligned, rest)[::side], dim=-1)
+    if shift > 0:
+        # the end of x is added to the beginning of y
+        return torch.cat((x[:, :, shift:] + y[:, :, :n_aligned], y[:, :, n_aligned:]), dim=-1)
+    # the beginning of x is added to the end of y
+    return torch.cat((y[:, :, :-n_aligned], x[:, :, :shift] + y[:, :, -n_aligned:]), dim=-1)
 
 
 def concat(x, y, shift=1):
@@ -27,9 +26,9 @@ def concat(x, y, shift=1):
         if x.size(-1) != y.size(-1):
             return concat(x, y, - x.size(-1) - y.size(-1))
         return y
-    side = np.sign(shift)
-    compl_x = slice(*((None, shift)[::side]))
-    return torch.cat((x[:, :, compl_x], y)[::side], dim=-1)
+    if shift > 0:
+        return torch.cat((x[:, :, :shift], y), dim=-1)
+    return torch.cat((y, x[:, :, shift:]), dim=-1)
 
 
 class FreqLayer(nn.Module):
@@ -69,7 +68,19 @@ class FreqLayer(nn.Module):
         self.with_skip_conv = with_skip_conv
         self.with_residual_conv = with_residual_conv
 
-        self.pad = LearnablePad1d(self.input_dim, self.padding, self.learn_padding)
+        # the quantities derived from the architecture are computed once and for all
+        self._dilation = self.kernel_size ** self.layer_index
+        self._padding = self.pad_input * (self.kernel_size - 1) * self._dilation
+        self._receptive_field = self.kernel_size ** (self.layer_index + 1)
+        self._shift = self._receptive_field + self.layer_index * int(self.strict)
+        self._rel_shift = (int(self.strict) + (self.kernel_size - 1) * self._dilation) \
+            if self.pad_input == 0 else int(self.strict)
+
+        # only learned paddings need a module, zeros are padded with F.pad on the (left, right) sides
+        self.pad = LearnablePad1d(self.input_dim, self.padding, self.learn_padding) \
+            if self.learn_padding and self.padding != 0 else None
+        self._pad_sides = None if self.padding == 0 else \
+            (self.padding, 0) if self.padding > 0 else (0, -self.padding)
 
         convs_kwargs = dict(dilation=self.dilation, stride=self.stride,
                             groups=self.groups, bias=self.bias)
@@ -80,34 +91,40 @@ class FreqLayer(nn.Module):
         self.residuals = nn.Conv1d(self.layer_dim, self.input_dim, kernel_size=1, **convs_kwargs) \
             if self.with_residual_conv else None
 
-    def forward(self, x, skip=None):
-        input = self.pad(x)
+        # the shifts applied in forward only depend on the architecture
+        shift = self.rel_shift()
+        self._accum_shift = shift * self.accum_outputs
+        self._concat_shift = shift * self.concat_outputs
+        # skips are accumulated on the right when the outputs aren't accumulated
+        self._skip_shift = self._accum_shift if self.accum_outputs else shift
+
+    def forward(self, x: torch.Tensor, skip: Optional[torch.Tensor] = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        if self.pad is not None:
+            input = self.pad(x)
+        elif self._pad_sides is not None:
+            input = F.pad(x, self._pad_sides)
+        else:
+            input = x
 
         y = self.gate(input)
         h = self.skips(y) if self.with_skip_conv else None
         y = self.residuals(y) if self.with_residual_conv else y
 
-        accum_outputs, concat_outputs = self.accum_outputs, self.concat_outputs
-        shift = self.rel_shift()
-
-        if accum_outputs:
-            y = accum(x, y, shift * accum_outputs)
+        if self.accum_outputs:
+            y = accum(x, y, self._accum_shift)
 
-        if concat_outputs:
-            y = concat(x, y, shift * concat_outputs)
+        if self.concat_outputs:
+            y = concat(x, y, self._concat_shift)
 
         if self.with_skip_conv:
             if skip is None:
                 skip = torch.zeros_like(h).to(h)
-            if accum_outputs:
-                # we do it on the same side as the outputs
-                skip = accum(skip, h, shift * accum_outputs)
-            else:
-                # we accum on the right anyway, otherwise skips don't make any sense,
-                # since they aren't inputs to anything...
-                skip = accum(skip, h, shift * 1)
-            if concat_outputs:
-                skip = concat(skip, h, shift * concat_outputs)
+            # if the outputs are accumulated, we do it on the same side as the outputs.
+            # otherwise we accum on the right anyway, because skips don't make any sense,
+            # since they aren't inputs to anything...
+            skip = accum(skip, h, self._skip_shift)
+            if self.concat_outputs:
+                skip = concat(skip, h, self._concat_shift)
         else:
             # still need to output a tensor
             skip = y
@@ -115,7 +132,7 @@ class FreqLayer(nn.Module):
 
     @property
     def dilation(self):
-        return self.kernel_size ** self.layer_index
+        return self._dilation
 
     @property
     def padding(self):
@@ -123,21 +140,21 @@ class FreqLayer(nn.Module):
         signed amount of padding necessary to output as many time-steps as there were in the inputs.
         The sign of padding corresponds to the desired side (1: left, -1: right)
         """
-        return self.pad_input * (self.kernel_size - 1) * self.dilation
+        return self._padding
 
     def receptive_field(self):
         """
         amount of inputs necessary for 1 output (this is independent of the shift!)
         """
-        return self.kernel_size ** (self.layer_index + 1)
+        return self._receptive_field
 
     def shift(self):
         """total shift at this layer wrt. to the beginning of its block"""
-        return self.receptive_field() + self.layer_index * int(self.strict)
+        return self._shift
 
     def rel_shift(self):
         """relative shift at this layer wrt. to the previous layer"""
-        return (int(self.strict) + (self.kernel_size - 1) * self.dilation) if self.pad_input == 0 else int(self.strict)
+        return self._rel_shift
 
     def output_length(self, input_length):
         if abs(self.concat_outputs):
@@ -147,6 +164,6 @@ class FreqLayer(nn.Module):
             # no matter what, padding input gives the same output shape
             return input_length
         # output is gonna be less than input
-        numerator = input_length - self.dilation * (self.kernel_size - 1) - 1
+        numerator = input_length - self._dilation * (self.kernel_size - 1) - 1
         denominator = self.stride
         return math.floor(1 + numerator / denominator)
@@ -1,11 +1,29 @@
+import torch
 import torch.nn as nn
-import numpy as np
+from functools import wraps
+from itertools import accumulate
+import warnings
 
 from .modules import GatedLinearInput, AbsLinearOutput, mean_L1_prop
 from .freq_layer import FreqLayer
 from .base import FreqNetModel
 
 
+def memoized(method):
+    """
+    decorator caching the results of a method that only depends on the architecture of the network (and on
+    its arguments). The results are computed the first time they are requested, i.e. after the layers are built.
+    """
+    @wraps(method)
+    def wrapper(self, *args):
+        cache = self.__dict__.setdefault("_arch_cache", {})
+        key = (method.__qualname__, args)
+        if key not in cache:
+            cache[key] = method(self, *args)
+        return cache[key]
+    return wrapper
+
+
 class FreqNet(FreqNetModel):
     LAYER_KWARGS = ["groups", "strict", "accum_outputs", "concat_outputs", "kernel_size",
                     "pad_input", "learn_padding", "with_skip_conv", "with_residual_conv"]
@@ -23,6 +41,7 @@ class FreqNet(FreqNetModel):
                  learn_padding=False,
                  with_skip_conv=True,
                  with_residual_conv=True,
+                 compile_layers=False,
                  **data_optim_kwargs):
         super(FreqNet, self).__init__(**data_optim_kwargs)
         self._loss_fn = loss_fn
@@ -52,25 +71,38 @@ class FreqNet(FreqNetModel):
         # Output Decoder
         self.outpt = AbsLinearOutput(self.model_dim, self.input_dim)
 
+        # let torch fuse the python loop over the layers
+        if compile_layers:
+            if hasattr(torch, "compile"):
+                self._layers_forward = torch.compile(self._layers_forward, mode="reduce-overhead")
+            else:
+                warnings.warn("`compile_layers=True` requires torch >= 2.0. The layers won't be compiled.")
+
         self.save_hyperparameters()
 
+    def _layers_forward(self, x):
+        skips = None
+        for layer in self.layers:
+            x, skips = layer(x, skips)
+        return skips
+
     def forward(self, x):
         """
         """
         x = self.inpt(x)
-        skips = None
-        for layer in self.layers:
-            x, skips = layer(x, skips)
+        skips = self._layers_forward(x)
         x = self.outpt(skips)
         return x
 
     def loss_fn(self, predictions, targets):
         return self._loss_fn(predictions, targets)
 
+    @memoized
     def all_rel_shifts(self):
         """sequence of shifts from one layer to the next"""
         return tuple(layer.rel_shift() for layer in self.layers)
 
+    @memoized
     def shift(self):
         """total shift of the network"""
         if not self.strict and (self.pad_input == 1 or self.concat_outputs == 1):
@@ -84,10 +116,13 @@ class FreqNet(FreqNetModel):
         else:
             return sum(self.all_rel_shifts()) + int(not self.strict)
 
+    @memoized
     def all_shifts(self):
         """the accumulated shift at each layer"""
-        return tuple(np.cumsum(self.all_rel_shifts()) + int(not self.strict))
+        offset = int(not self.strict)
+        return tuple(shift + offset for shift in accumulate(self.all_rel_shifts()))
 
+    @memoized
     def receptive_field(self):
         block_rf = []
         for i, layer in enumerate(self.layers[:-1]):
@@ -96,9 +131,11 @@ class FreqNet(FreqNetModel):
         block_rf += [self.layers[-1].receptive_field()]
         return sum(block_rf)
 
+    @memoized
     def output_length(self, input_length):
         return self.all_output_lengths(input_length)[-1]
 
+    @memoized
     def all_output_lengths(self, input_length):
         out_length = input_length
         lengths = []
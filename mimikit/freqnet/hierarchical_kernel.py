@@ -1,8 +1,7 @@
-import torch
 import torch.nn as nn
 
-from .freqnet import FreqNet
-from .modules import mean_L1_prop
+from .freqnet import FreqNet, memoized
+from .modules import mean_L1_prop, gated
 
 
 class HKFreqNet(FreqNet):
@@ -44,35 +43,36 @@ class HKFreqNet(FreqNet):
         # the conv2d layer adds a power of 2 to the n standard layers before it
         n_outs = self.output_length(x.size(-1))
 
-        # stack the 2 encoder outputs
-        hk_input = torch.stack((x[:, :, -n_outs - 1:-1], x[:, :, -n_outs:]), dim=-1)
+        # the 2 encoder outputs and the n layers are written in place in the input of the conv2d
+        hk_input = x.new_empty(x.size(0), x.size(1), n_outs, 2 + len(self.layers))
+        hk_input[..., 0] = x[:, :, -n_outs - 1:-1]
+        hk_input[..., 1] = x[:, :, -n_outs:]
         skip = None
 
-        for layer in self.layers:
+        for i, layer in enumerate(self.layers):
             x, skip = layer(x, skip)
             # we only keep n_outs outputs finishing at the -`layer.shift()` step
-            to_stack = slice(-n_outs - layer.shift(), -layer.shift())
-            hk_input = torch.cat((hk_input, skip[:, :, to_stack].unsqueeze(-1)), dim=-1)
+            hk_input[..., 2 + i] = skip[:, :, -n_outs - layer.shift():-layer.shift()]
 
         # Do the Gated2dConv on the gathered pieces of layers
-        f = nn.Tanh()(self.conv_f(hk_input))
-        g = nn.Sigmoid()(self.conv_g(hk_input))
-
-        y = self.outpt((f * g).squeeze(-1))
+        y = self.outpt(gated(self.conv_f(hk_input), self.conv_g(hk_input)).squeeze(-1))
         return y
 
+    @memoized
     def receptive_field(self):
         # rf of the standard layers
         rf = super(HKFreqNet, self).receptive_field()
         # rf WITH HK layer :
         return rf * 2
 
+    @memoized
     def all_rel_shifts(self):
         """sequence of shifts from one layer to the next"""
         stack = super(HKFreqNet, self).all_rel_shifts()
         # add the last HK layer
         return (*stack, 2 * stack[-1])
 
+    @memoized
     def all_output_lengths(self, input_length):
         out_length = input_length
         lengths = []
@@ -1,6 +1,13 @@
+import torch
 import torch.nn as nn
 
 
+@torch.jit.script
+def gated(f, g):
+    """tanh(f) * sigmoid(g) scripted so that the fuser can run it as a single elementwise kernel"""
+    return torch.tanh(f) * torch.sigmoid(g)
+
+
 class GatedLinear(nn.Module):
     def __init__(self, in_dim, out_dim, **kwargs):
         super(GatedLinear, self).__init__()
@@ -8,21 +15,44 @@ class GatedLinear(nn.Module):
         self.fcf = nn.Linear(in_dim, out_dim, **kwargs)
 
     def forward(self, x):
-        f = nn.Tanh()(self.fcf(x))
-        g = nn.Sigmoid()(self.fcg(x))
-        return f * g
+        return gated(self.fcf(x), self.fcg(x))
 
 
 class GatedConv(nn.Module):
+    """
+    gated convolution where the convolutions of the tanh and of the sigmoid legs are a single convolution with
+    ``2 * c_out`` output channels.
+
+    In each group, the first half of the output channels goes to the tanh and the second half to the sigmoid, so that
+    the gate is equivalent to two separate convolutions with the same ``groups``. State dicts with separate
+    ``conv_f`` and ``conv_g`` weights are fused when they are loaded.
+    """
     def __init__(self, c_in, c_out, kernel_size=2, transpose=False, **kwargs):
         super(GatedConv, self).__init__()
         mod = nn.Conv1d if not transpose else nn.ConvTranspose1d
-        self.conv_f = mod(c_in, c_out, kernel_size, **kwargs)
-        self.conv_g = mod(c_in, c_out, kernel_size, **kwargs)
-        self.tanh = nn.Tanh()
-        self.sig = nn.Sigmoid()
+        self.transpose = transpose
+        self.groups = kwargs.get("groups", 1)
+        self.proj = mod(c_in, 2 * c_out, kernel_size, **kwargs)
 
     def forward(self, x):
-        f = self.tanh(self.conv_f(x))
-        g = self.sig(self.conv_g(x))
-        return f * g
+        y = self.proj(x)
+        B, T = y.size(0), y.size(-1)
+        y = y.view(B, self.groups, 2, -1, T)
+        return gated(y[:, :, 0], y[:, :, 1]).reshape(B, -1, T)
+
+    def _fuse(self, f, g, is_weight):
+        if is_weight and self.transpose:
+            # (c_in, c_out / groups, k) : the output channels of each group are on dim 1
+            return torch.cat((f, g), dim=1)
+        # (c_out, ...) : the output channels are grouped on dim 0
+        G = self.groups
+        return torch.stack((f.view(G, -1, *f.shape[1:]), g.view(G, -1, *g.shape[1:])), dim=1) \
+            .reshape(-1, *f.shape[1:])
+
+    def _load_from_state_dict(self, state_dict, prefix, *args, **kwargs):
+        for param in ("weight", "bias"):
+            f, g = prefix + "conv_f." + param, prefix + "conv_g." + param
+            if f in state_dict and g in state_dict:
+                state_dict[prefix + "proj." + param] = self._fuse(state_dict.pop(f), state_dict.pop(g),
+                                                                  param == "weight")
+        super(GatedConv, self)._load_from_state_dict(state_dict, prefix, *args, **kwargs)
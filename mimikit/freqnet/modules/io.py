@@ -1,3 +1,4 @@
+import torch
 import torch.nn as nn
 from .gated_units import GatedLinear
 
@@ -25,4 +26,6 @@ class AbsLinearOutput(nn.Module):
             nn.Linear(in_dim, out_dim, **kwargs))
 
     def forward(self, x):
-        return self.fc(x).abs()
+        y = self.fc(x).abs()
+        # outputs computed in half-precision are given back in full precision for the loss
+        return y.float() if y.dtype in (torch.float16, torch.bfloat16) else y
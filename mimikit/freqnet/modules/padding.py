@@ -17,5 +17,6 @@ class LearnablePad1d(nn.Module):
     def forward(self, x):
         if self.pad is None:
             return x
-        self.pad = self.pad.to(x)
-        return torch.cat((torch.stack([self.pad] * x.size(0)), x)[::self.side], dim=-1)
\ No newline at end of file
+        # cast locally : assigning a plain Tensor to a registered Parameter raises (e.g. under autocast)
+        pad = self.pad.to(x)
+        return torch.cat((torch.stack([pad] * x.size(0)), x)[::self.side], dim=-1)
\ No newline at end of file
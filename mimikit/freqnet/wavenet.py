@@ -81,8 +81,6 @@ class WaveNet(FreqNet):
 
     def forward(self, x):
         x = self.inpt(x.squeeze())
-        skips = None
-        for layer in self.layers:
-            x, skips = layer(x, skips)
+        skips = self._layers_forward(x)
         x = self.outpt(skips)
         return x
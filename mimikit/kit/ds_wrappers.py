@@ -1,9 +1,17 @@
 from copy import copy
+import numpy as np
+import torch
 
 from ..data.data_object import DataObject
 
 
 class DSWrapper(DataObject):
+    """
+    base class for objects that wrap a ``DataObject`` and change what its items are.
+
+    Items must be tuples of arrays or tensors of fixed shapes so that loaders can collate them with ``zip_stack``
+    into a ``Batch``, which, in turn, can be pinned when the loader is created with ``pin_memory=True``.
+    """
 
     def __init__(self):
         pass
@@ -24,10 +32,45 @@ class DSWrapper(DataObject):
     def __call__(self, dataset: DataObject):
         return self.upgrade(dataset)
 
+    def _gather(self, indices):
+        """
+        index ``self.data`` with an array of indices of any shape in a single call.
+
+        @param indices: array-like of ints
+        @return: the gathered data of shape ``(*indices.shape, *item_shape)`` or None if ``self.data`` doesn't
+        support batched indexing
+        """
+        indices = np.asarray(indices, dtype=np.int64)
+        data = self.data
+        if isinstance(data, torch.Tensor):
+            return data[torch.from_numpy(indices).to(data.device)]
+        if isinstance(data, np.ndarray):
+            return data[indices]
+        if hasattr(data, "__getitems__") and indices.size > 0:
+            items = data.__getitems__(indices.ravel().tolist())
+            if not isinstance(items, np.ndarray):
+                items = np.stack(items)
+            return items.reshape(*indices.shape, *items.shape[1:])
+        return None
+
+    def __getitems__(self, indices):
+        """
+        batched version of ``__getitem__`` used by ``DataLoader`` (torch>=2.0) to fetch all the items of a batch
+        at once
+        """
+        return [self[i] for i in indices]
+
 
 class InputEqualTarget(DSWrapper):
     def __getitem__(self, item):
-        return tuple(self.data[i] for i in [item, item])
+        x = self.data[item]
+        return x, x
+
+    def __getitems__(self, indices):
+        batch = self._gather(indices)
+        if batch is None:
+            return super(InputEqualTarget, self).__getitems__(indices)
+        return [(x, x) for x in batch]
 
     def __len__(self):
         return len(self.data)
@@ -41,6 +84,8 @@ class ShiftedSeqsPair(DSWrapper):
         @param stride:
         """
         self.shifts, self.lengths = list(zip(*[(0, input_length), *targets]))
+        # (start, stop) of each sequence relative to the index of an item
+        self.offsets = tuple((shift, shift + length) for shift, length in zip(self.shifts, self.lengths))
         self.stride = stride
         self.N = None
 
@@ -54,9 +99,53 @@ class ShiftedSeqsPair(DSWrapper):
         return ln
 
     def __getitem__(self, item):
-        i = item * self.stride
-        items_slices = [slice(i + shift, i + shift + length)
-                         for shift, length in zip(self.shifts, self.lengths)]
-        return tuple(self.data[idx] for idx in items_slices)
-
+        if isinstance(item, np.ndarray):
+            # a whole batch of items
+            batch = self._get_batch(item)
+            if any(seqs is None for seqs in batch):
+                # the data can't be indexed with arrays : we stack the items one by one
+                batch = tuple(np.stack(seqs) for seqs in zip(*(self[i] for i in item.tolist())))
+            return batch
+        i, data = item * self.stride, self.data
+        return tuple(data[i + start:i + stop] for start, stop in self.offsets)
+
+    def _get_batch(self, items):
+        starts = np.asarray(items, dtype=np.int64)[:, None] * self.stride
+        if hasattr(self.data, "windows"):
+            # read the span covering all the sequences of an item once and slice the sequences out of it
+            lo, hi = min(start for start, _ in self.offsets), max(stop for _, stop in self.offsets)
+            block = self.data.windows(starts[:, 0] + lo, hi - lo)
+            return tuple(block[:, start - lo:stop - lo] for start, stop in self.offsets)
+        # one (batch_size x length) array of indices per sequence
+        return tuple(self._gather(starts + np.arange(start, stop)) for start, stop in self.offsets)
+
+    def __getitems__(self, indices):
+        batches = self._get_batch(indices)
+        if any(batch is None for batch in batches):
+            return super(ShiftedSeqsPair, self).__getitems__(indices)
+        return list(zip(*batches))
+
+
+class FrameSampler(object):
+    """
+    batch sampler yielding one array of indices per batch.
+
+    Shuffling is a single ``np.random.permutation`` per epoch and the batches are views of the permuted indices,
+    hence no python object is created per index. Instances can be passed as ``batch_sampler`` to a ``DataLoader``,
+    or as ``sampler`` together with ``batch_size=None`` when the dataset accepts arrays of indices.
+    """
+    def __init__(self, indices, batch_size=64, shuffle=True, drop_last=False):
+        self.indices = np.asarray(indices)
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.drop_last = drop_last
 
+    def __len__(self):
+        n, bs = len(self.indices), self.batch_size
+        return n // bs if self.drop_last else (n + bs - 1) // bs
+
+    def __iter__(self):
+        indices = np.random.permutation(self.indices) if self.shuffle else self.indices
+        bs = self.batch_size
+        for b in range(len(self)):
+            yield indices[b * bs:(b + 1) * bs]
@@ -58,6 +58,7 @@ def get_trainer(root_dir=None,
         - the `progress_bar_refresh_rate` is set to `20` which avoids spurious crashes in colab
         - `num_sanity_val_steps` is set to 0
         - the number of `gpus` is set to automatically be the number of devices `torch` discovered.
+        - `benchmark` is set to `True` so that cudnn picks the fastest kernels for the (fixed) shapes of the batches
         - a default `MMKDefaultLogger` will be added to the loggers if you don't pass `loggers=False` in the `kwargs.
           It is a subclass of a `TestTubeLogger` from `lightning` and will save its files in `root_dir/logs`
 
@@ -133,5 +134,6 @@ def get_trainer(root_dir=None,
     kwargs.setdefault("process_position", 1)
     kwargs.setdefault("num_sanity_val_steps", 0)  # this is 2 by default and messes up the steps count...
     kwargs.setdefault("gpus", torch.cuda.device_count() if torch.cuda.is_available() else 0)
+    kwargs.setdefault("benchmark", True)
     print("Checkpoints and logs will be saved in", os.path.abspath(default_root_dir))
     return Trainer(default_root_dir=default_root_dir, **kwargs)
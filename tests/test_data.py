@@ -75,3 +75,16 @@ def test_make_root_db_and_Database(audio_tree):
     assert ds is not None, ds
     assert len(ds) == len(db.fft), (len(ds), len(db.fft))
     assert np.all(ds[:10] == db.fft[:10])
+
+    # test batched reads
+    indices = [7, 2, 2, 0]
+    items = db.fft.__getitems__(indices)
+    assert len(items) == len(indices)
+    assert all(np.all(item == db.fft[i]) for item, i in zip(items, indices))
+    assert db.fft.__getitems__([]).dtype == db.fft.dtype == db.fft[:1].dtype
+    windows = db.fft.windows([3, 0], 4)
+    assert windows.shape == (2, 4, *db.fft.shape[1:])
+    assert np.all(windows[0] == db.fft[3:7]) and np.all(windows[1] == db.fft[0:4])
+    db.fft.open(rdcc_nbytes=2 ** 20)
+    assert np.all(db.fft[:4] == ds[:4])
+    db.fft.close()
@@ -3,6 +3,8 @@ import numpy as np
 import torch
 
 from mimikit.data import DataObject
+from mimikit.data.data_object import prefetch, zip_stack, as_tensor
+import mimikit.data.data_object as data_object
 
 
 class Case:
@@ -96,6 +98,14 @@ def test_to_tensor(init_valid_case):
         assert isinstance(case.ds.data, torch.Tensor), type(case.ds.data)
 
 
+def test_as_tensor_dtypes():
+    assert as_tensor([[0.5, 1.], [2., 3.]]).dtype == torch.get_default_dtype()
+    assert as_tensor([1, 2, 3]).dtype == torch.int64
+    assert as_tensor(np.zeros(3, dtype=np.float64)).dtype == torch.float64
+    with pytest.raises(TypeError):
+        as_tensor("abc")
+
+
 def test_to_device():
     pass
 
@@ -142,3 +152,47 @@ def test_constructor_exceptions(init_invalid_case):
     msg = case.expected["msg"]
     with pytest.raises(exception, match=r".* " + msg + r".*"):
         assert case.ds is not None
+
+
+def test_zip_stack(monkeypatch):
+    samples = [(np.full((3, 2), i, dtype=np.float32), torch.full((4,), i, dtype=torch.bfloat16)) for i in range(5)]
+    batch = zip_stack(samples)
+    assert isinstance(batch, list) and len(batch) == 2
+    assert batch[0].shape == (5, 3, 2) and batch[0].dtype == torch.float32
+    assert batch[1].shape == (5, 4) and batch[1].dtype == torch.bfloat16
+    for i in range(5):
+        assert torch.all(batch[0][i] == i) and torch.all(batch[1][i] == i)
+
+    # in a worker, the outputs are allocated in shared memory
+    monkeypatch.setattr(data_object, "get_worker_info", lambda: object())
+    batch = zip_stack(samples)
+    assert all(t.is_shared() for t in batch)
+    assert torch.equal(batch[0], torch.from_numpy(np.stack([s[0] for s in samples])))
+    monkeypatch.undo()
+
+    # samples that aren't tuples fall back to default_collate
+    batch = zip_stack([np.arange(3) + i for i in range(5)])
+    assert isinstance(batch, torch.Tensor) and batch.shape == (5, 3)
+    batch = zip_stack([float(i) for i in range(5)])
+    assert isinstance(batch, torch.Tensor) and batch.shape == (5,)
+
+
+def test_prefetch():
+    assert list(prefetch(range(10))) == list(range(10))
+
+    def faulty():
+        yield 0
+        raise RuntimeError("faulty")
+
+    with pytest.raises(RuntimeError, match=r".*faulty.*"):
+        list(prefetch(faulty()))
+
+    class Iterable:
+        def __init__(self, sign):
+            self.sign = sign
+
+        def __iter__(self):
+            return iter([self.sign * x for x in range(10)])
+
+    ds = DataObject((Iterable(1), Iterable(-1)))
+    assert list(ds) == [(x, -x) for x in range(10)]
@@ -3,9 +3,11 @@ import numpy as np
 import torch
 import soundfile
 
-from mimikit.kit import get_trainer
+from mimikit.kit import get_trainer, ShiftedSeqsPair
 from mimikit.freqnet import *
-from mimikit.data import freqnet_db
+from mimikit.freqnet.base import TensorSeqsLoader
+from mimikit.freqnet.modules import GatedConv
+from mimikit.data import freqnet_db, DataObject, zip_stack
 
 
 @pytest.fixture
@@ -76,6 +78,119 @@ def test_base(tmp_path):
     assert len(optims[0][0].param_groups[0]) > 0
 
 
+class GenerativeModel(FreqNetModel):
+    def __init__(self, output_slice=slice(-1, None), **kwargs):
+        super(GenerativeModel, self).__init__(**kwargs)
+        self.output_slice = output_slice
+        self.fc = torch.nn.Linear(8, 8)
+
+    def forward(self, x):
+        return torch.tanh(self.fc(x))
+
+    def generation_slices(self):
+        return slice(-4, None), self.output_slice
+
+    def targets_shifts_and_lengths(self, input_length):
+        return [(1, input_length), ]
+
+
+@pytest.mark.parametrize("output_slice, expected_slice", [
+    (-1, slice(-1, None)),
+    (-2, slice(-2, -1)),
+    (slice(-2, None), slice(-2, None)),
+    (None, slice(None)),
+])
+def test_generate_matches_concatenation(output_slice, expected_slice):
+    model = GenerativeModel(output_slice=output_slice, data_object=np.random.randn(32, 8), splits=[1.])
+    prompt = torch.randn(1, 2, 8)
+    n_steps = 5
+
+    generated = model.generate(prompt, n_steps, time_domain=False, cuda_graph=False)
+
+    expected = prompt
+    with torch.no_grad():
+        for _ in range(n_steps):
+            out = model(expected[:, -4:])
+            expected = torch.cat((expected, out[:, expected_slice]), dim=1)
+    assert generated.shape == (1, *expected.shape), (generated.shape, expected.shape)
+    assert torch.allclose(generated[0], expected, atol=1e-5)
+
+
+def test_generation_mode_restores_state():
+    model = GenerativeModel(data_object=np.random.randn(32, 8), splits=[1.])
+    model.train()
+
+    def faulty(x):
+        raise RuntimeError("faulty")
+
+    model.forward = faulty
+    with pytest.raises(RuntimeError, match=r".*faulty.*"):
+        model.generate(torch.randn(1, 4, 8), 3, time_domain=False, cuda_graph=False)
+    assert model.training
+    assert model.device.type == "cpu"
+    assert torch.is_grad_enabled()
+
+
+def test_tensor_seqs_loader():
+    data = torch.arange(40.).reshape(20, 2)
+    ds = ShiftedSeqsPair(input_length=4, targets=[(1, 4)])(DataObject(data))
+    subset, = ds.split([1.])
+
+    loader = TensorSeqsLoader(subset, batch_size=5, shuffle=True, drop_last=False)
+    assert len(loader) == 4, len(loader)
+    batches = list(loader)
+    assert len(batches) == len(loader)
+    for batch in batches:
+        assert isinstance(batch, list), type(batch)
+        inpt, target = batch
+        assert inpt.shape[1:] == (4, 2) and target.shape[1:] == (4, 2), (inpt.shape, target.shape)
+        assert torch.all(inpt[:, 1:] == target[:, :-1])
+    # every sequence is served once per epoch
+    assert sum(b[0].size(0) for b in batches) == len(ds)
+
+    loader = TensorSeqsLoader(subset, batch_size=5, shuffle=False, drop_last=True)
+    assert len(loader) == 3, len(loader)
+    assert all(b[0].size(0) == 5 for b in loader)
+
+
+def test_custom_loader_kwargs_use_a_dataloader():
+    class Model:
+        @staticmethod
+        def targets_shifts_and_lengths(input_length):
+            return [(1, input_length)]
+
+    def collate(batch):
+        return zip_stack(batch)
+
+    data = torch.arange(40.).reshape(20, 2)
+    dm = FreqData(Model(), data, input_seq_length=4, batch_size=5, splits=[1.], num_workers=0)
+    assert isinstance(dm.train_dataloader(), TensorSeqsLoader)
+    dm = FreqData(Model(), data, input_seq_length=4, batch_size=5, splits=[1.], num_workers=0, collate_fn=collate)
+    loader = dm.train_dataloader()
+    assert isinstance(loader, torch.utils.data.DataLoader) and loader.collate_fn is collate
+    inpt, target = next(iter(loader))
+    assert inpt.shape == (5, 4, 2) and target.shape == (5, 4, 2)
+
+
+def test_batched_loader_of_feature_proxy(audio_tree):
+    db = freqnet_db(audio_tree + "/test_db.h5", roots=audio_tree)
+
+    class Model:
+        @staticmethod
+        def targets_shifts_and_lengths(input_length):
+            return [(1, input_length)]
+
+    dm = FreqData(Model(), db.fft, input_seq_length=4, batch_size=3, in_mem_data=False,
+                  splits=[1.], num_workers=0, shuffle=False)
+    loader = dm.train_dataloader()
+    assert not isinstance(loader, TensorSeqsLoader)
+    inpt, target = next(iter(loader))
+    assert inpt.shape == (3, 4, db.fft.shape[1]) and target.shape == (3, 4, db.fft.shape[1])
+    for b, i in enumerate(dm.train_ds.indices[:3]):
+        expected_inpt, expected_target = dm.ds[i]
+        assert np.all(inpt[b].numpy() == expected_inpt) and np.all(target[b].numpy() == expected_target)
+
+
 def test_layer_computed_properties():
     cases = [
         (FreqLayer(layer_index=0, ),
@@ -123,6 +238,20 @@ def test_single_layer_output_length():
             ("forward case_" + str(i), outpt.size(-1), expected, layer.padding)
 
 
+@pytest.mark.skipif(not hasattr(torch, "autocast"), reason="torch.autocast requires torch>=1.10")
+def test_learned_padding_under_autocast():
+    layer = FreqLayer(layer_index=1, pad_input="left", learn_padding=True)
+    inpt = torch.randn(2, layer.input_dim, 16).to(torch.bfloat16)
+    with torch.autocast("cpu", dtype=torch.bfloat16):
+        outpt, _ = layer(inpt)
+    assert outpt.size(-1) == 16
+    # the parameter is cast locally, not replaced
+    assert isinstance(layer.pad.pad, torch.nn.Parameter)
+    assert layer.pad.pad.dtype == torch.float32
+    outpt.float().sum().backward()
+    assert layer.pad.pad.grad is not None
+
+
 def test_freqnet_computed_properties():
     input_length = 16
     data_object = torch.randn(1, input_length, 1025)
@@ -227,4 +356,17 @@ def test_models_train(tmp_path):
 
         trainer.fit(mdl)
         # print("FREQSHAPES:", mdl.targets_shifts_and_lengths(8), mdl(data_object[:8].unsqueeze(0)).shape)
-        assert trainer.global_step > 0, type(mdl)
\ No newline at end of file
+        assert trainer.global_step > 0, type(mdl)
+
+
+def test_gated_conv_loads_separate_convs():
+    x = torch.randn(3, 4, 8)
+    for transpose, groups in [(False, 1), (False, 2), (True, 2)]:
+        mod = torch.nn.Conv1d if not transpose else torch.nn.ConvTranspose1d
+        conv_f, conv_g = mod(4, 6, 2, groups=groups), mod(4, 6, 2, groups=groups)
+        expected = torch.tanh(conv_f(x)) * torch.sigmoid(conv_g(x))
+        gate = GatedConv(4, 6, 2, transpose=transpose, groups=groups)
+        state = {"conv_f." + k: v for k, v in conv_f.state_dict().items()}
+        state.update({"conv_g." + k: v for k, v in conv_g.state_dict().items()})
+        gate.load_state_dict(state)
+        assert torch.allclose(gate(x), expected, atol=1e-6), (transpose, groups)
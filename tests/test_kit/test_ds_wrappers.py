@@ -1,6 +1,6 @@
 import numpy as np
 
-from mimikit.kit import DataObject, DSWrapper, InputEqualTarget, ShiftedSeqsPair
+from mimikit.kit import DataObject, DSWrapper, InputEqualTarget, ShiftedSeqsPair, FrameSampler
 
 
 class TestBaseWrapper:
@@ -58,3 +58,46 @@ class TestShiftedSeqsPair:
     def test_overrides_len(self):
         ds = self.wrapper(self.ds)
         assert len(ds) < len(self.ds), (len(ds), len(self.ds))
+
+    def test_getitem_with_array_returns_batch(self):
+        ds = self.wrapper(self.ds)
+        indices = np.array([2, 0, 5])
+        inputs, targets = ds[indices]
+        assert inputs.shape == (3, self.wrapper.lengths[0], self.data.shape[-1]), inputs.shape
+        assert targets.shape == (3, self.wrapper.lengths[1], self.data.shape[-1]), targets.shape
+        assert np.all(inputs[1] == ds[0][0]) and np.all(targets[2] == ds[5][1])
+
+    def test_getitem_with_array_of_unbatchable_data(self):
+        ds = self.wrapper(DataObject(self.data.tolist()))
+        inputs, targets = ds[np.array([2, 0, 5])]
+        assert inputs.shape == (3, self.wrapper.lengths[0], self.data.shape[-1]), inputs.shape
+        assert targets.shape == (3, self.wrapper.lengths[1], self.data.shape[-1]), targets.shape
+        assert np.all(inputs[1] == np.array(ds[0][0])) and np.all(targets[2] == np.array(ds[5][1]))
+
+
+class TestFrameSampler:
+    indices = np.arange(3, 20)
+
+    def test_yields_arrays_of_all_indices(self):
+        sampler = FrameSampler(self.indices, batch_size=5, shuffle=True)
+        batches = list(sampler)
+        assert len(batches) == len(sampler) == 4, (len(batches), len(sampler))
+        assert all(isinstance(b, np.ndarray) for b in batches)
+        assert np.all(np.sort(np.concatenate(batches)) == self.indices)
+
+    def test_drop_last(self):
+        sampler = FrameSampler(self.indices, batch_size=5, shuffle=False, drop_last=True)
+        batches = list(sampler)
+        assert len(batches) == len(sampler) == 3, (len(batches), len(sampler))
+        assert np.all(batches[0] == self.indices[:5])
+
+
+def test_getitems_equals_getitem():
+    data = np.random.randn(10, 4)
+    for wrapper in [InputEqualTarget(), ShiftedSeqsPair(input_length=2, targets=[(1, 3)])]:
+        ds = wrapper(DataObject(data))
+        indices = [3, 0, 3, 1]
+        batch = ds.__getitems__(indices)
+        assert len(batch) == len(indices)
+        for items, i in zip(batch, indices):
+            assert all(np.all(x == y) for x, y in zip(items, ds[i]))